@@ -1,62 +1,113 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from fastapi import Body, FastAPI, Header, HTTPException
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from dotenv import load_dotenv
-import psycopg2
+from async_lru import alru_cache
+import asyncio
+import asyncpg
+import datetime
+import decimal
+import functools
+import redis.asyncio as redis
+import sqlglot
+from sqlglot import exp
+import hashlib
+import httpx
+import json
+import numpy as np
+import orjson
 import os
 import re
+import secrets
+import time
 from google import genai
+from google.genai import errors as genai_errors, types as genai_types
 from fastapi.staticfiles import StaticFiles
-from psycopg2.pool import SimpleConnectionPool
-from contextlib import contextmanager
 import logging
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
-
 # Load environment variables
 load_dotenv()
 
+# Set up logging (LOG_LEVEL=DEBUG logs raw LLM responses)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
+logger = logging.getLogger(__name__)
+
+# JSON serialization: orjson handles dates, times and UUIDs natively; this covers the
+# other values asyncpg returns (numeric, interval, bytea, ranges, geometry, inet, ...)
+def orjson_default(obj):
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, datetime.timedelta):
+        return obj.total_seconds()
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return "\\x" + bytes(obj).hex()
+    if isinstance(obj, asyncpg.Range):
+        return {"lower": obj.lower, "upper": obj.upper}
+    if isinstance(obj, tuple):
+        return list(obj)
+    return str(obj)
+
+class F1JSONResponse(ORJSONResponse):
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, default=orjson_default, option=orjson.OPT_NON_STR_KEYS)
+
 # FastAPI app
-app = FastAPI()
+app = FastAPI(default_response_class=F1JSONResponse)
 
 # Serve static files (HTML, CSS, JS)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-# Pydantic model for request
-class QueryRequest(BaseModel):
-    query: str
-
 # Database connection
-pool = None
+DB_POOL_MIN_SIZE = 5
 
-def init_db_pool():
-    global pool
-    pool = SimpleConnectionPool(
-        minconn=1,
-        maxconn=10,
+async def init_db_connection(conn: asyncpg.Connection) -> None:
+    """Have the server probe idle connections so NAT drops are detected early"""
+    await conn.execute(
+        "SET tcp_keepalives_idle = 30; SET tcp_keepalives_interval = 10; SET tcp_keepalives_count = 3"
+    )
+
+async def init_db_pool() -> asyncpg.Pool:
+    pool = await asyncpg.create_pool(
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=20,
+        timeout=30,
+        command_timeout=10,
+        # Recycle idle connections before intermediaries silently drop them
+        max_inactive_connection_lifetime=240,
+        server_settings={"application_name": "f1-stats"},
+        init=init_db_connection,
         user=os.getenv("SUPABASE_USER"),
         password=os.getenv("SUPABASE_PASSWORD"),
         host=os.getenv("SUPABASE_HOST"),
         port=os.getenv("SUPABASE_PORT"),
-        dbname=os.getenv("SUPABASE_DBNAME")
+        database=os.getenv("SUPABASE_DBNAME"),
+        # Set to 0 behind a transaction-mode pooler that can't hold prepared statements
+        statement_cache_size=int(os.getenv("PG_STATEMENT_CACHE_SIZE", "1024"))
     )
+    await warm_db_pool(pool)
+    return pool
 
-@contextmanager
-def get_db_connection():
-    conn = None
-    try:
-        conn = pool.getconn()
-        yield conn
-    except Exception as e:
-        logger.error(f"Database connection error: {e}")
-        raise HTTPException(status_code=500, detail=f"Database connection error: {str(e)}")
-    finally:
-        if conn:
-            pool.putconn(conn)
+async def warm_db_pool(pool: asyncpg.Pool) -> None:
+    """Ping min_size connections at once so the first requests don't pay for the handshake"""
+    async def ping():
+        async with pool.acquire() as conn:
+            await conn.execute("SELECT 1")
+    await asyncio.gather(*(ping() for _ in range(DB_POOL_MIN_SIZE)))
 
-# Initialize Google Gemini client
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))  # Updated to match .env
+# Redis connection (optional; caches are process-local only without it)
+def init_redis():
+    url = os.getenv("REDIS_URL")
+    return redis.from_url(url) if url else None
+
+# Initialize Google Gemini client, sharing one pooled HTTP/2 connection per worker
+gemini_http = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+    timeout=httpx.Timeout(60.0)
+)
+client = genai.Client(
+    api_key=os.getenv("GEMINI_API_KEY"),  # Updated to match .env
+    http_options=genai_types.HttpOptions(httpx_async_client=gemini_http)
+)
 
 # SQL generation prompt
 SQL_PROMPT = """
@@ -143,103 +194,629 @@ FROM results
 JOIN drivers ON results."driverId" = drivers."driverId"
 JOIN races ON results."raceId" = races."raceId"
 WHERE drivers."surname" = 'Verstappen' AND races."year" = 2023 AND results."positionOrder" = 1;
-
-Query: {query}
 """
 
-def generate_sql_query(query: str) -> str:
+# Gemini context cache holding the static schema/rules prompt
+GEMINI_MODEL = "gemini-2.0-flash"
+PROMPT_CACHE_TTL = 3600
+# Extend the cache's TTL this long before it would expire
+PROMPT_CACHE_REFRESH_MARGIN = 300
+# Explicit caches below the model's minimum size are rejected by the API
+PROMPT_CACHE_MIN_TOKENS = int(os.getenv("PROMPT_CACHE_MIN_TOKENS", "4096"))
+
+def estimate_tokens(text: str) -> int:
+    # Gemini averages roughly four characters per token for English text
+    return len(text) // 4
+
+class PromptCache:
+    """Handle to a Gemini cached content entry for SQL_PROMPT, falling back to inline prompts"""
+
+    def __init__(self):
+        self.name = None
+        self._refresh_task = None
+        self._keep_alive_task = None
+
+    async def start(self) -> None:
+        tokens = estimate_tokens(SQL_PROMPT)
+        if tokens < PROMPT_CACHE_MIN_TOKENS:
+            logger.info(
+                f"SQL prompt (~{tokens} tokens) is below the {PROMPT_CACHE_MIN_TOKENS}-token "
+                "context cache minimum, sending schema inline"
+            )
+            return
+        await self.refresh()
+        self._keep_alive_task = asyncio.get_running_loop().create_task(self._keep_alive())
+
+    async def stop(self) -> None:
+        if self._keep_alive_task:
+            self._keep_alive_task.cancel()
+
+    async def _keep_alive(self) -> None:
+        """Extend (or recreate) the cache before its TTL runs out"""
+        while True:
+            await asyncio.sleep(PROMPT_CACHE_TTL - PROMPT_CACHE_REFRESH_MARGIN)
+            if self.name:
+                try:
+                    await client.aio.caches.update(
+                        name=self.name,
+                        config=genai_types.UpdateCachedContentConfig(ttl=f"{PROMPT_CACHE_TTL}s")
+                    )
+                    continue
+                except Exception as e:
+                    logger.warning(f"Could not extend Gemini prompt cache, recreating it: {e}")
+            await self.refresh()
+
+    async def refresh(self) -> None:
+        try:
+            cache = await client.aio.caches.create(
+                model=GEMINI_MODEL,
+                config=genai_types.CreateCachedContentConfig(
+                    system_instruction=SQL_PROMPT,
+                    ttl=f"{PROMPT_CACHE_TTL}s",
+                    display_name="f1-sql-prompt"
+                )
+            )
+            self.name = cache.name
+            logger.info(f"Gemini prompt cache created: {cache.name}")
+        except Exception as e:
+            # e.g. Gemini is unreachable, or the model's minimum is higher than configured
+            self.name = None
+            logger.warning(f"Gemini prompt cache unavailable, sending schema inline: {e}")
+
+    def schedule_refresh(self) -> None:
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.get_running_loop().create_task(self.refresh())
+
+    def generate_config(self) -> genai_types.GenerateContentConfig:
+        if self.name:
+            return genai_types.GenerateContentConfig(cached_content=self.name)
+        return genai_types.GenerateContentConfig(system_instruction=SQL_PROMPT)
+
+prompt_cache = PromptCache()
+
+_FENCE_RE = re.compile(r"```(?:sql)?\s*(.*?)```", re.DOTALL | re.IGNORECASE)
+
+# Bound concurrent Gemini calls per worker to stay within API rate limits
+GEMINI_CONCURRENCY = int(os.getenv("GEMINI_CONCURRENCY", "20"))
+gemini_semaphore = asyncio.Semaphore(GEMINI_CONCURRENCY)
+
+async def generate_content(prompt: str):
+    async with gemini_semaphore:
+        return await client.aio.models.generate_content(
+            model=GEMINI_MODEL, contents=prompt, config=prompt_cache.generate_config()
+        )
+
+async def generate_sql_query(query: str) -> str:
     try:
-        prompt = SQL_PROMPT.format(query=query)
-        response = client.models.generate_content(
-    model="gemini-2.0-flash", contents=prompt
-)
-        print(f"Raw LLM response : {response.text}")
-        # Extract SQL query
-        sql_query = response.text.strip()
-        print(f"Raw SQL response: {sql_query}")
-        # Clean up the SQL query
-        sql_query = sql_query.split("SQL:")[-1].strip()
-        if sql_query.startswith("```sql"):
-            sql_query = sql_query.split("```sql")[1].split("```")[0].strip()
-        elif sql_query.startswith("```"):
-            sql_query = sql_query.split("```")[1].strip()
-        # Remove any leading/trailing whitespace
-        sql_query = sql_query.strip()   
-        if "```sql" in sql_query:
-            sql_query = sql_query.split("```sql")[1].split("```")[0].strip()
-        elif "```" in sql_query:
-            sql_query = sql_query.split("```")[1].strip()
-        print(f"Generated SQL: {sql_query}")
+        prompt = f"Query: {query}"
+        try:
+            response = await generate_content(prompt)
+        except genai_errors.ClientError as e:
+            if not prompt_cache.name:
+                raise
+            # Cached content expired, was evicted or is otherwise unusable:
+            # answer inline and recreate it
+            prompt_cache.name = None
+            prompt_cache.schedule_refresh()
+            response = await generate_content(prompt)
+        # Extract the SQL query from a markdown fence if the model added one
+        sql_query = response.text
+        match = _FENCE_RE.search(sql_query)
+        sql_query = (match.group(1) if match else sql_query).split("SQL:")[-1].strip()
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Raw LLM response: {response.text}")
+            logger.debug(f"Generated SQL: {sql_query}")
         return sql_query
     except Exception as e:
-        print(f"Error generating SQL: {e}")
+        logger.error(f"Error generating SQL: {e}")
         raise HTTPException(status_code=500, detail=f"LLM error: {str(e)}")
 
+# Semantic cache: reuse SQL generated for questions phrased similarly
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_TTL = 3600
+SEMANTIC_CACHE_MAX_ENTRIES = 1024
+EMBEDDING_MODEL = "text-embedding-004"
+
+_QUERY_TOKEN_RE = re.compile(r"\w+(?:\.\d+)?")
+# Function and question words; everything else ("monaco", "2023", "wins", "most")
+# can change which rows the SQL should return
+QUERY_STOPWORDS = frozenset({
+    "a", "an", "the", "of", "in", "at", "on", "for", "to", "by", "from", "with", "and", "or",
+    "who", "whom", "whose", "what", "which", "when", "where", "how", "why",
+    "is", "are", "was", "were", "be", "been", "did", "does", "do", "has", "have", "had",
+    "show", "list", "give", "find", "get", "tell", "me", "us", "all", "please", "s"
+})
+
+def query_literals(query: str) -> frozenset:
+    """Case-folded content words of a question, which must match for a semantic hit"""
+    return frozenset(
+        token for token in _QUERY_TOKEN_RE.findall(query.casefold()) if token not in QUERY_STOPWORDS
+    )
+
+class SemanticCache:
+    """In-process nearest-neighbour index of (query embedding, SQL) pairs, mirrored to Redis"""
+
+    key_prefix = "f1:sem:"
+    # Sorted set of entry keys scored by store time, so workers can fetch only what's new
+    log_key = "f1:sem:log"
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.clear_local()
+
+    def clear_local(self) -> None:
+        self.vectors = None  # (SEMANTIC_CACHE_MAX_ENTRIES, dim) matrix, allocated on first store
+        self.slots = []  # row -> (key, sql, literals, expires_at)
+        self.rows = {}  # key -> row
+        self.synced_at = 0.0  # newest Redis log score already loaded
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _add(self, key, vector, sql, literals, expires_at):
+        if self.vectors is None:
+            self.vectors = np.zeros((SEMANTIC_CACHE_MAX_ENTRIES, len(vector)), dtype=np.float32)
+        row = self.rows.get(key)
+        if row is None:
+            if len(self.slots) < SEMANTIC_CACHE_MAX_ENTRIES:
+                row = len(self.slots)
+                self.slots.append(None)
+            else:
+                # Reuse the row closest to expiry
+                row = min(range(len(self.slots)), key=lambda i: self.slots[i][3])
+                del self.rows[self.slots[row][0]]
+            self.rows[key] = row
+        self.vectors[row] = vector
+        self.slots[row] = (key, sql, literals, expires_at)
+
+    def lookup(self, vector, literals):
+        if self.slots:
+            now = time.time()
+            scores = self.vectors[:len(self.slots)] @ vector
+            candidates = np.flatnonzero(scores >= SEMANTIC_CACHE_THRESHOLD)
+            for row in candidates[np.argsort(-scores[candidates])]:
+                _, sql, cached_literals, expires_at = self.slots[row]
+                # Similar wording isn't enough: "monaco 2023 winner" must not reuse Silverstone's SQL
+                if expires_at > now and cached_literals == literals:
+                    return sql
+        return None
+
+    async def store(self, query, vector, sql):
+        key = hashlib.sha256(query.encode()).hexdigest()
+        literals = query_literals(query)
+        now = time.time()
+        self._add(key, vector, sql, literals, now + SEMANTIC_CACHE_TTL)
+        if app.state.redis:
+            payload = json.dumps({"vector": vector.tolist(), "sql": sql, "literals": sorted(literals)})
+            async with app.state.redis.pipeline(transaction=False) as pipe:
+                pipe.set(self.key_prefix + key, payload, ex=SEMANTIC_CACHE_TTL)
+                pipe.zadd(self.log_key, {key: now})
+                pipe.zremrangebyscore(self.log_key, "-inf", now - SEMANTIC_CACHE_TTL)
+                await pipe.execute()
+
+    async def clear(self, redis_client) -> None:
+        self.clear_local()
+        if redis_client:
+            await delete_keys(redis_client, self.key_prefix + "*")
+
+    async def sync(self, redis_client) -> bool:
+        """Pull entries other workers stored since the last sync; True if any were added"""
+        log_entries = await redis_client.zrangebyscore(
+            self.log_key, f"({self.synced_at}", "+inf", withscores=True
+        )
+        if not log_entries:
+            return False
+        keys = [key.decode() for key, _ in log_entries]
+        payloads = await redis_client.mget([self.key_prefix + key for key in keys])
+        added = False
+        for key, (_, stored_at), payload in zip(keys, log_entries, payloads):
+            expires_at = stored_at + SEMANTIC_CACHE_TTL
+            if payload is None or expires_at <= time.time():
+                continue
+            entry = json.loads(payload)
+            self._add(
+                key, self._normalize(entry["vector"]), entry["sql"],
+                frozenset(entry.get("literals", ())), expires_at
+            )
+            added = True
+        self.synced_at = max(self.synced_at, log_entries[-1][1])
+        return added
+
+semantic_cache = SemanticCache()
+
+async def delete_keys(redis_client, pattern: str) -> None:
+    async for key in redis_client.scan_iter(match=pattern):
+        await redis_client.delete(key)
+
+async def embed_query(query: str):
+    async with gemini_semaphore:
+        response = await client.aio.models.embed_content(model=EMBEDDING_MODEL, contents=query)
+    return SemanticCache._normalize(response.embeddings[0].values)
+
+def normalize_query(query: str) -> str:
+    # Case is kept: it carries through to literals such as driver surnames
+    return " ".join(query.split())
+
+# Exact repeats are answered from memory before any embedding or Gemini call
+@alru_cache(maxsize=2048, ttl=SEMANTIC_CACHE_TTL)
+async def generate_sql_query_cached(query: str) -> str:
+    """Return SQL for a similar earlier question if there is one, else ask Gemini"""
+    # Raising keeps rejected SQL out of both caches (alru_cache doesn't cache exceptions)
+    try:
+        vector = await embed_query(query)
+    except Exception as e:
+        logger.warning(f"Embedding error, skipping semantic cache: {e}")
+        return ensure_valid_sql(await generate_sql_query(query))
+
+    literals = query_literals(query)
+    sql_query = semantic_cache.lookup(vector, literals)
+    if sql_query is None and app.state.redis:
+        # Another worker may already have answered something similar
+        try:
+            if await semantic_cache.sync(app.state.redis):
+                sql_query = semantic_cache.lookup(vector, literals)
+        except redis.RedisError as e:
+            logger.warning(f"Redis error syncing semantic cache: {e}")
+    if sql_query is not None and validate_sql_query(sql_query):
+        semantic_cache.hits += 1
+        logger.info(f"Semantic cache hit (hits={semantic_cache.hits}, misses={semantic_cache.misses})")
+        return sql_query
+    semantic_cache.misses += 1
+
+    sql_query = ensure_valid_sql(await generate_sql_query(query))
+    try:
+        await semantic_cache.store(query, vector, sql_query)
+    except redis.RedisError as e:
+        logger.warning(f"Redis error, semantic cache entry kept in-process only: {e}")
+    return sql_query
+
+# Cache generation: /cache/clear bumps a Redis counter so every worker drops its
+# in-process caches, not just the one that served the request
+CACHE_GENERATION_CHECK_INTERVAL = 1.0
+
+def clear_local_caches() -> None:
+    generate_sql_query_cached.cache_clear()
+    semantic_cache.clear_local()
+
+class CacheGeneration:
+    """Last seen value of the shared cache generation counter"""
+
+    key = "f1:cache:generation"
+
+    def __init__(self):
+        self.value = None
+        self.checked_at = None
+
+    async def sync(self, redis_client) -> None:
+        """Clear local caches if another worker bumped the counter (checked at most once a second)"""
+        now = time.monotonic()
+        if self.checked_at is not None and now - self.checked_at < CACHE_GENERATION_CHECK_INTERVAL:
+            return
+        value = await redis_client.get(self.key)
+        if self.checked_at is not None and value != self.value:
+            clear_local_caches()
+            logger.info("Caches cleared by another worker")
+        self.value, self.checked_at = value, now
+
+    async def bump(self, redis_client) -> None:
+        self.value = str(await redis_client.incr(self.key)).encode()
+        self.checked_at = time.monotonic()
+
+cache_generation = CacheGeneration()
+
+ALLOWED_TABLES = frozenset({"circuits", "constructors", "drivers", "races", "results"})
+FORBIDDEN_NODES = (
+    exp.Insert, exp.Update, exp.Delete, exp.Merge, exp.Create, exp.Drop, exp.Alter,
+    exp.Command, exp.Into, exp.Union,
+    # Table-function sources (LATERAL f(...), unnest(...)) read data outside the allowed tables
+    exp.Lateral, exp.Unnest
+)
+# Functions can reach data too (query_to_xml, pg_read_file, dblink, ...), so only these
+# aggregate, numeric, string, date and window functions are allowed
+ALLOWED_FUNCTIONS = (
+    exp.Count, exp.Sum, exp.Avg, exp.Min, exp.Max, exp.ArrayAgg, exp.GroupConcat,
+    exp.Round, exp.Abs, exp.Ceil, exp.Floor, exp.Greatest, exp.Least,
+    exp.Coalesce, exp.Nullif, exp.Case, exp.If, exp.Cast, exp.Exists, exp.Array,
+    exp.Lower, exp.Upper, exp.Initcap, exp.Concat, exp.ConcatWs, exp.Length, exp.Substring,
+    exp.Trim, exp.Left, exp.Right, exp.Replace, exp.SplitPart, exp.StrPosition,
+    exp.Extract, exp.CurrentDate, exp.CurrentTimestamp, exp.TimestampTrunc, exp.DateTrunc,
+    exp.TimeToStr, exp.StrToDate, exp.RowNumber, exp.Rank, exp.DenseRank
+)
+# Postgres functions sqlglot has no dedicated node for
+ALLOWED_ANONYMOUS_FUNCTIONS = frozenset({"age", "date_part", "make_date"})
+
+def function_allowed(func: exp.Func) -> bool:
+    # AND/OR and other operators are Func nodes in sqlglot too
+    if isinstance(func, (exp.Connector, exp.Binary, exp.Unary)):
+        return True
+    if isinstance(func, exp.Anonymous):
+        return func.name.lower() in ALLOWED_ANONYMOUS_FUNCTIONS
+    return isinstance(func, ALLOWED_FUNCTIONS)
+
+@functools.lru_cache(maxsize=1024)
+def parse_select(sql: str):
+    """Parse a single read-only SELECT over the allowed tables, or return None"""
+    try:
+        statements = [s for s in sqlglot.parse(sql, read="postgres") if s is not None]
+    except sqlglot.errors.SqlglotError:
+        return None
+
+    # Exactly one statement, and it must be a plain SELECT
+    if len(statements) != 1 or not isinstance(statements[0], exp.Select):
+        return None
+    tree = statements[0]
+    if any(tree.find_all(*FORBIDDEN_NODES)):
+        return None
+    if not all(function_allowed(func) for func in tree.find_all(exp.Func)):
+        return None
+
+    # Every referenced table must be allowed. An unqualified name may refer to one of the
+    # query's own CTEs, but a schema-qualified one never does (WITH pg_user AS (...) must
+    # not whitelist pg_catalog.pg_user)
+    ctes = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+    tables = [
+        table for table in tree.find_all(exp.Table)
+        if table.db or table.catalog or table.name.lower() not in ctes
+    ]
+    if not tables:
+        return None
+    for table in tables:
+        # FROM f(...) parses as a Table wrapping the function rather than an identifier
+        if not isinstance(table.this, exp.Identifier):
+            return None
+        if table.catalog or table.name.lower() not in ALLOWED_TABLES or table.db.lower() not in ("", "public"):
+            return None
+
+    return tree
+
 def validate_sql_query(sql: str) -> bool:
     """Validate SQL query for security"""
-    # Check for dangerous SQL commands
-    dangerous_commands = [
-        r'\bdrop\b', r'\bdelete\b', r'\btruncate\b', r'\balter\b',
-        r'\binsert\b', r'\bupdate\b', r'\bcreate\b', r'\bexec\b',
-        r'\bunion\b', r'\binto\b'
-    ]
-    if any(re.search(pattern, sql, re.IGNORECASE) for pattern in dangerous_commands):
-        return False
-        
-    # Check if query starts with SELECT
-    if not re.match(r"^\s*SELECT\b", sql, re.IGNORECASE):
-        return False
-        
-    # Validate tables
-    allowed_tables = {"circuits", "constructors", "drivers", "races", "results"}
-    table_matches = re.findall(r'\bFROM\s+([a-zA-Z_][a-zA-Z0-9_]*)|JOIN\s+([a-zA-Z_][a-zA-Z0-9_]*)', sql, re.IGNORECASE)
-    tables = {match[0] or match[1] for match in table_matches}
-    if not all(table.lower() in allowed_tables for table in tables):
-        return False
-        
-    return True
+    return parse_select(sql) is not None
+
+def ensure_valid_sql(sql: str) -> str:
+    if not validate_sql_query(sql):
+        raise HTTPException(status_code=400, detail="Invalid or unsafe SQL query")
+    return sql
+
+# Plan reuse: bind literals compared against columns as $n parameters, so
+# structurally identical queries share one prepared statement
+COMPARISON_NODES = (exp.EQ, exp.NEQ, exp.GT, exp.GTE, exp.LT, exp.LTE, exp.Like, exp.ILike)
+# DATE columns in the schema: a '2020-01-01' string bound to a date parameter fails
+# asyncpg's encoding, so these comparisons stay inline for Postgres to coerce
+DATE_COLUMNS = frozenset({"dob", "date"})
+
+def parameterize_sql(sql: str):
+    tree = parse_select(sql)
+    if tree is None:
+        return sql, []
+    tree = tree.copy()
+    params = []
+    for literal in list(tree.find_all(exp.Literal)):
+        parent = literal.parent
+        # Only string and integer literals whose type Postgres can infer from a column;
+        # other literals (decimals, LIMIT counts, select-list values) stay inline
+        if not (literal.is_string or literal.is_int):
+            continue
+        if isinstance(parent, COMPARISON_NODES):
+            other = parent.expression if literal is parent.this else parent.this
+        elif isinstance(parent, exp.In):
+            other = parent.this
+        else:
+            continue
+        if not isinstance(other, exp.Column) or other.name.lower() in DATE_COLUMNS:
+            continue
+        params.append(literal.to_py())
+        literal.replace(exp.Parameter(this=exp.Literal.number(len(params))))
+    return tree.sql(dialect="postgres"), params
+
+# Query execution: stream rows through a server-side cursor to bound memory
+MAX_ROWS = 10000
+FETCH_BATCH_SIZE = 1000
+
+async def open_cursor(conn: asyncpg.Connection, sql: str, *params):
+    """Open a cursor in a read-only transaction and fetch its first batch"""
+    # Fetching eagerly surfaces SQL errors before any response bytes are sent
+    transaction = conn.transaction(readonly=True)
+    await transaction.start()
+    try:
+        cursor = await conn.cursor(sql, *params)
+        first_batch = await cursor.fetch(FETCH_BATCH_SIZE)
+    except BaseException:
+        await transaction.rollback()
+        raise
+    return transaction, cursor, first_batch
+
+def is_argument_encoding_error(e: asyncpg.DataError) -> bool:
+    # Raised client-side by asyncpg; server-side SQLSTATE 22 errors (division by zero,
+    # bad datetime format) are DataError subclasses and would fail the same way inline
+    return str(e).startswith("invalid input for query argument")
+
+def encode_rows(batch) -> bytes:
+    return b",".join(orjson.dumps(list(row), default=orjson_default) for row in batch)
+
+async def release_connection(conn: asyncpg.Connection, transaction=None) -> None:
+    try:
+        if transaction is not None:
+            await transaction.rollback()
+    finally:
+        await app.state.pg.release(conn)
+
+async def stream_results(conn, transaction, cursor, columns, first_chunk: bytes, count: int,
+                         head: bytes, sql: str):
+    """Yield the response JSON batch by batch while the cursor is still reading"""
+    # The first batch was encoded by run_query, so errors there still became HTTP errors.
+    # Everything after head doubles as the result cache entry (at most MAX_ROWS rows)
+    chunks = [b'"columns":' + orjson.dumps(columns) + b',"rows":[' + first_chunk]
+    truncated = False
+    try:
+        yield head + chunks[0]
+        while count < MAX_ROWS:
+            batch = await cursor.fetch(FETCH_BATCH_SIZE)
+            if not batch:
+                break
+            if count + len(batch) > MAX_ROWS:
+                batch, truncated = batch[:MAX_ROWS - count], True
+            chunk = b"," + encode_rows(batch)
+            count += len(batch)
+            chunks.append(chunk)
+            yield chunk
+        else:
+            # Reached MAX_ROWS exactly: only truncated if the cursor has more
+            if not truncated:
+                truncated = bool(await cursor.fetch(1))
+    except Exception as e:
+        # The 200 status is already sent; close the document with an error the UI can show
+        logger.error(f"Error while streaming results: {e}")
+        yield (
+            b'],"count":' + str(count).encode()
+            + b',"truncated":true,"error":"Results stream interrupted, showing partial results"}'
+        )
+        return
+    finally:
+        await release_connection(conn, transaction)
+    tail = b'],"count":' + str(count).encode() + b',"truncated":' + (b"true" if truncated else b"false") + b"}"
+    chunks.append(tail)
+    yield tail
+    await set_cached_results(sql, b"{" + b"".join(chunks))
+
+# Result cache: reuse rows for SQL that has already been executed
+RESULT_CACHE_TTL = 3600
+_QUOTED_RE = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")""")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+def normalize_sql(sql: str) -> str:
+    """Lowercase and collapse whitespace outside quoted literals and identifiers"""
+    parts = _QUOTED_RE.split(sql.strip().rstrip(";").rstrip())
+    return "".join(
+        part if i % 2 else _WHITESPACE_RE.sub(" ", part).lower()
+        for i, part in enumerate(parts)
+    )
+
+def result_cache_key(sql: str) -> str:
+    return "f1:sql:v3:" + hashlib.sha256(normalize_sql(sql).encode()).hexdigest()
+
+async def get_cached_results(sql: str) -> bytes | None:
+    if not app.state.redis:
+        return None
+    try:
+        cached = await app.state.redis.get(result_cache_key(sql))
+    except redis.RedisError as e:
+        logger.warning(f"Redis error reading result cache: {e}")
+        return None
+    return cached
+
+async def set_cached_results(sql: str, payload: bytes) -> None:
+    """Store an encoded {"columns", "rows", "count", "truncated"} JSON object"""
+    if not app.state.redis:
+        return
+    try:
+        await app.state.redis.set(result_cache_key(sql), payload, ex=RESULT_CACHE_TTL)
+    except redis.RedisError as e:
+        logger.warning(f"Redis error writing result cache: {e}")
 
 @app.post("/query")
-async def run_query(request: QueryRequest):
+async def run_query(query: str = Body(..., embed=True)):
     try:
-        # Generate SQL
-        sql_query = generate_sql_query(request.query)
-        
-        # Validate query
-        if not validate_sql_query(sql_query):
-            raise HTTPException(status_code=400, detail="Invalid or unsafe SQL query")
-
-        # Execute query with connection pooling
-        with get_db_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(sql_query)
-                results = cur.fetchall()
-                columns = [desc[0] for desc in cur.description]
-
-        # Format results
-        formatted_results = [dict(zip(columns, row)) for row in results]
-        return {
-            "query": request.query,
-            "sql": sql_query,
-            "results": formatted_results,
-            "count": len(formatted_results)
-        }
-    except psycopg2.Error as e:
+        if app.state.redis:
+            try:
+                await cache_generation.sync(app.state.redis)
+            except redis.RedisError as e:
+                logger.warning(f"Redis error checking cache generation: {e}")
+
+        # Generate and validate SQL
+        sql_query = await generate_sql_query_cached(normalize_query(query))
+
+        head = b'{"query":' + orjson.dumps(query) + b',"sql":' + orjson.dumps(sql_query) + b","
+        cached = await get_cached_results(sql_query)
+        if cached is not None:
+            return Response(head + cached[1:], media_type="application/json")
+
+        # Execute query with connection pooling; the stream releases the connection
+        conn = await app.state.pg.acquire()
+        transaction = None
+        try:
+            parameterized_sql, params = parameterize_sql(sql_query)
+            try:
+                transaction, cursor, batch = await open_cursor(conn, parameterized_sql, *params)
+            except asyncpg.DataError as e:
+                if not (params and is_argument_encoding_error(e)):
+                    raise
+                # A literal didn't fit the inferred column type (e.g. '2023' for an
+                # INTEGER column); Postgres coerces it fine when left inline
+                transaction, cursor, batch = await open_cursor(conn, sql_query)
+            # Encode the first batch before any bytes are sent so failures map to an HTTP error
+            columns = list(batch[0].keys()) if batch else []
+            first_chunk = encode_rows(batch)
+        except BaseException:
+            await release_connection(conn, transaction)
+            raise
+        return StreamingResponse(
+            stream_results(
+                conn, transaction, cursor, columns, first_chunk, len(batch),
+                head=head, sql=sql_query
+            ),
+            media_type="application/json"
+        )
+    except HTTPException:
+        raise
+    except asyncpg.PostgresError as e:
         logger.error(f"Database error: {e}")
         raise HTTPException(status_code=400, detail=f"Database error: {str(e)}")
+    except TimeoutError as e:
+        logger.error(f"Database timeout: {e}")
+        raise HTTPException(status_code=504, detail="Database query timed out")
+    except (OSError, asyncpg.InterfaceError) as e:
+        logger.error(f"Database connection error: {e}")
+        raise HTTPException(status_code=500, detail=f"Database connection error: {str(e)}")
     except Exception as e:
         logger.error(f"Unexpected error: {e}")
         raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
 
+@app.post("/cache/clear")
+async def clear_cache(x_admin_token: str | None = Header(default=None)):
+    """Drop cached SQL and results (requires the ADMIN_TOKEN header)"""
+    admin_token = os.getenv("ADMIN_TOKEN")
+    if not admin_token or not x_admin_token or not secrets.compare_digest(x_admin_token, admin_token):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    clear_local_caches()
+    try:
+        await semantic_cache.clear(app.state.redis)
+        if app.state.redis:
+            await delete_keys(app.state.redis, "f1:sql:*")
+            await cache_generation.bump(app.state.redis)
+    except redis.RedisError as e:
+        logger.error(f"Redis error clearing caches: {e}")
+        raise HTTPException(status_code=500, detail=f"Redis error: {str(e)}")
+    logger.info("Caches cleared")
+    return {"status": "cleared"}
+
 @app.on_event("startup")
 async def startup_event():
     """Initialize database pool when the application starts"""
-    init_db_pool()
+    app.state.pg = await init_db_pool()
+    app.state.redis = init_redis()
+    await prompt_cache.start()
+    if app.state.redis:
+        try:
+            await cache_generation.sync(app.state.redis)
+            await semantic_cache.sync(app.state.redis)
+        except redis.RedisError as e:
+            logger.warning(f"Could not load semantic cache from Redis: {e}")
     logger.info("Application started, database pool initialized")
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Close all database connections when the application shuts down"""
-    if pool:
-        pool.closeall()
+    pg = getattr(app.state, "pg", None)
+    if pg:
+        await pg.close()
+    redis_client = getattr(app.state, "redis", None)
+    if redis_client:
+        await redis_client.aclose()
+    await prompt_cache.stop()
+    await gemini_http.aclose()
     logger.info("Application shutdown, database pool closed")
@@ -24,13 +24,12 @@ function setLoading(isLoading) {
     }
 }
 
-// Format the results into a table
-function formatResults(results) {
-    if (!results || results.length === 0) {
+// Format the columnar results into a table
+function formatResults(columns, rows) {
+    if (!rows || rows.length === 0) {
         return '<p>No results found</p>';
     }
 
-    const columns = Object.keys(results[0]);
     let table = '<table class="results-table"><thead><tr>';
     
     // Add headers
@@ -40,10 +39,10 @@ function formatResults(results) {
     table += '</tr></thead><tbody>';
     
     // Add data rows
-    results.forEach(row => {
+    rows.forEach(row => {
         table += '<tr>';
-        columns.forEach(column => {
-            table += `<td>${row[column] ?? ''}</td>`;
+        row.forEach(value => {
+            table += `<td>${value ?? ''}</td>`;
         });
         table += '</tr>';
     });
@@ -91,7 +90,12 @@ const submitQuery = debounce(async () => {
 
         const data = await response.json();
         sqlDiv.innerHTML = `<pre><code>${data.sql}</code></pre>`;
-        resultsDiv.innerHTML = formatResults(data.results);
+        resultsDiv.innerHTML = formatResults(data.columns, data.rows);
+        if (data.error) {
+            resultsDiv.innerHTML += `<div class="error-message"><p>Error: ${data.error}</p></div>`;
+        } else if (data.truncated) {
+            resultsDiv.innerHTML += `<p>Showing the first ${data.count} rows</p>`;
+        }
     } catch (error) {
         handleError(error);
     } finally {
@@ -0,0 +1,9 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# main.py builds the Gemini client and mounts static/ at import time
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
@@ -0,0 +1,93 @@
+import re
+
+import pytest
+import sqlglot
+
+from main import parameterize_sql
+
+
+@pytest.mark.parametrize("sql, expected_sql, expected_params", [
+    # Comparisons against columns become parameters
+    (
+        'SELECT drivers."forename" FROM drivers WHERE drivers."surname" = \'Hamilton\'',
+        'SELECT drivers."forename" FROM drivers WHERE drivers."surname" = $1',
+        ["Hamilton"],
+    ),
+    (
+        'SELECT * FROM races WHERE races."year" IN (2021, 2022)',
+        'SELECT * FROM races WHERE races."year" IN ($1, $2)',
+        [2021, 2022],
+    ),
+    (
+        'SELECT * FROM drivers WHERE drivers."surname" LIKE \'Sch%\' AND drivers."nationality" ILIKE \'german\'',
+        'SELECT * FROM drivers WHERE drivers."surname" LIKE $1 AND drivers."nationality" ILIKE $2',
+        ["Sch%", "german"],
+    ),
+    (
+        'SELECT * FROM results WHERE 10 <= results."points"',
+        'SELECT * FROM results WHERE $1 <= results."points"',
+        [10],
+    ),
+    # Literals whose type Postgres couldn't infer from a column stay inline
+    (
+        'SELECT \'x\' AS label, drivers."code" FROM drivers LIMIT 5',
+        'SELECT \'x\' AS label, drivers."code" FROM drivers LIMIT 5',
+        [],
+    ),
+    (
+        'SELECT * FROM results WHERE results."points" > -1',
+        'SELECT * FROM results WHERE results."points" > -1',
+        [],
+    ),
+    (
+        'SELECT * FROM results WHERE results."grid" = CAST(1 AS TEXT)',
+        'SELECT * FROM results WHERE results."grid" = CAST(1 AS TEXT)',
+        [],
+    ),
+    (
+        'SELECT * FROM results WHERE results."points" > 1.5',
+        'SELECT * FROM results WHERE results."points" > 1.5',
+        [],
+    ),
+    (
+        'SELECT * FROM drivers WHERE 1 = 1',
+        'SELECT * FROM drivers WHERE 1 = 1',
+        [],
+    ),
+    # DATE columns are left for Postgres to coerce
+    (
+        'SELECT * FROM races WHERE races."date" > \'2020-01-01\'',
+        'SELECT * FROM races WHERE races."date" > \'2020-01-01\'',
+        [],
+    ),
+    (
+        'SELECT * FROM drivers WHERE drivers."dob" = \'1985-01-07\'',
+        'SELECT * FROM drivers WHERE drivers."dob" = \'1985-01-07\'',
+        [],
+    ),
+    # Unvalidated SQL is returned untouched
+    ("DROP TABLE drivers", "DROP TABLE drivers", []),
+])
+def test_parameterize_sql(sql, expected_sql, expected_params):
+    assert parameterize_sql(sql) == (expected_sql, expected_params)
+
+
+@pytest.mark.parametrize("sql", [
+    'SELECT * FROM races WHERE races."year" = 2020 AND races."round" > 3 AND races."name" LIKE \'%Monaco%\'',
+    """SELECT drivers."surname" FROM results
+JOIN drivers ON results."driverId" = drivers."driverId"
+JOIN races ON results."raceId" = races."raceId"
+WHERE races."year" IN (2021, 2022, 2023) AND 1 = results."positionOrder" AND drivers."code" <> 'HAM'""",
+])
+def test_parameter_numbers_match_params(sql):
+    parameterized, params = parameterize_sql(sql)
+    numbers = sorted(int(n) for n in re.findall(r"\$(\d+)", parameterized))
+    assert numbers == list(range(1, len(params) + 1))
+
+    # Substituting each $n with params[n - 1] gives back the original query
+    def literal(match):
+        value = params[int(match.group(1)) - 1]
+        return "'" + value.replace("'", "''") + "'" if isinstance(value, str) else str(value)
+
+    restored = re.sub(r"\$(\d+)", literal, parameterized)
+    assert restored == sqlglot.parse_one(sql, read="postgres").sql(dialect="postgres")
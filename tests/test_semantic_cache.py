@@ -0,0 +1,65 @@
+import time
+
+import numpy as np
+import pytest
+
+from main import SEMANTIC_CACHE_THRESHOLD, SemanticCache, query_literals
+
+
+@pytest.mark.parametrize("first, second", [
+    ("who won at monaco in 2023", "Who won at Monaco in 2023?"),
+    ("Show me all Monaco winners", "monaco winners"),
+    ("Who won the most races in 2023", "who won the MOST races in 2023"),
+])
+def test_query_literals_ignore_case_and_filler(first, second):
+    assert query_literals(first) == query_literals(second)
+
+
+@pytest.mark.parametrize("first, second", [
+    ("who won at monaco in 2023", "who won at silverstone in 2023"),
+    ("Who won the 2022 Monaco Grand Prix", "Who won the 2023 Monaco Grand Prix"),
+    ("Hamilton wins in 2021", "Verstappen wins in 2021"),
+    ("most wins in 2023", "fewest wins in 2023"),
+])
+def test_query_literals_differ_on_content(first, second):
+    assert query_literals(first) != query_literals(second)
+
+
+def unit(*values):
+    return SemanticCache._normalize(np.array(values, dtype=np.float32))
+
+
+def make_cache(*entries):
+    cache = SemanticCache()
+    for i, (query, vector, sql) in enumerate(entries):
+        cache._add(str(i), vector, sql, query_literals(query), time.time() + 60)
+    return cache
+
+
+def test_lookup_returns_sql_for_similar_question_with_same_literals():
+    cache = make_cache(("who won at monaco in 2023", unit(1, 0, 0), "SQL monaco"))
+    assert cache.lookup(unit(1, 0.01, 0), query_literals("Who won at Monaco in 2023?")) == "SQL monaco"
+
+
+def test_lookup_rejects_similar_question_with_different_literals():
+    cache = make_cache(("who won at monaco in 2023", unit(1, 0, 0), "SQL monaco"))
+    assert cache.lookup(unit(1, 0, 0), query_literals("who won at silverstone in 2023")) is None
+
+
+def test_lookup_picks_the_matching_entry_among_close_neighbours():
+    cache = make_cache(
+        ("who won at monaco in 2023", unit(1, 0, 0), "SQL monaco"),
+        ("who won at silverstone in 2023", unit(1, 0.05, 0), "SQL silverstone"),
+    )
+    assert cache.lookup(unit(1, 0, 0), query_literals("who won at silverstone in 2023")) == "SQL silverstone"
+
+
+def test_lookup_rejects_dissimilar_and_expired_entries():
+    cache = make_cache(("who won at monaco in 2023", unit(1, 0, 0), "SQL monaco"))
+    literals = query_literals("who won at monaco in 2023")
+    far = unit(1, 1, 0)
+    assert float(far @ unit(1, 0, 0)) < SEMANTIC_CACHE_THRESHOLD
+    assert cache.lookup(far, literals) is None
+
+    cache._add("0", unit(1, 0, 0), "SQL monaco", literals, time.time() - 1)
+    assert cache.lookup(unit(1, 0, 0), literals) is None
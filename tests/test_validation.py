@@ -0,0 +1,70 @@
+import pytest
+
+from main import validate_sql_query
+
+
+@pytest.mark.parametrize("sql", [
+    'SELECT drivers."forename", drivers."surname" FROM drivers LIMIT 1;',
+    """SELECT drivers."forename", races."name"
+FROM results
+JOIN drivers ON results."driverId" = drivers."driverId"
+JOIN races ON results."raceId" = races."raceId"
+WHERE drivers."surname" = 'Verstappen' AND races."year" = 2023""",
+    # Keywords inside literals are data, not commands
+    """SELECT drivers."surname" FROM drivers WHERE drivers."surname" = 'Updated; DROP TABLE x'""",
+    'SELECT * FROM public.drivers',
+    'WITH winners AS (SELECT * FROM results) SELECT * FROM winners',
+    'SELECT * FROM drivers WHERE drivers."driverId" IN (SELECT results."driverId" FROM results)',
+    # Aggregate, string, date and window functions
+    """SELECT drivers."surname", COUNT(*), SUM(results."points"), ROUND(AVG(results."points"), 2)
+FROM results JOIN drivers ON results."driverId" = drivers."driverId"
+GROUP BY drivers."surname" ORDER BY COUNT(*) DESC""",
+    """SELECT UPPER(drivers."code"), CONCAT(drivers."forename", ' ', drivers."surname"),
+EXTRACT(YEAR FROM drivers."dob"), AGE(races."date", drivers."dob"), CAST(results."grid" AS INTEGER),
+COALESCE(results."position", 'DNF'), RANK() OVER (ORDER BY results."points" DESC)
+FROM results JOIN drivers ON results."driverId" = drivers."driverId"
+JOIN races ON results."raceId" = races."raceId"
+WHERE EXISTS (SELECT 1 FROM races WHERE races."year" = 2023)""",
+])
+def test_accepts_reads_of_allowed_tables(sql):
+    assert validate_sql_query(sql)
+
+
+@pytest.mark.parametrize("sql", [
+    # Stacked statements
+    'SELECT * FROM drivers; DROP TABLE drivers',
+    'SELECT * FROM drivers; SELECT * FROM pg_catalog.pg_user',
+    # Writes and set operations
+    'DELETE FROM drivers',
+    'UPDATE drivers SET "surname" = \'x\'',
+    'SELECT * INTO stolen FROM drivers',
+    'SELECT * FROM drivers UNION SELECT * FROM races',
+    # Tables outside the allow list, directly or via subqueries and joins
+    'SELECT * FROM pg_user',
+    'SELECT * FROM pg_catalog.pg_user',
+    'SELECT * FROM drivers WHERE drivers."driverId" IN (SELECT usename FROM pg_catalog.pg_user)',
+    'SELECT * FROM (SELECT * FROM pg_catalog.pg_authid) AS t',
+    'SELECT * FROM drivers, pg_catalog.pg_authid',
+    'SELECT * FROM drivers CROSS JOIN information_schema.tables',
+    'SELECT * FROM other_schema.drivers',
+    # A CTE name must not whitelist a schema-qualified table of the same name
+    'WITH pg_authid AS (SELECT 1) SELECT rolname, rolpassword FROM drivers CROSS JOIN pg_catalog.pg_authid',
+    'WITH pg_user AS (SELECT 1) SELECT * FROM drivers, pg_catalog.pg_user',
+    'WITH x AS (SELECT 1) SELECT * FROM drivers JOIN information_schema.x ON true',
+    # Functions and table functions that read outside the allowed tables
+    "SELECT query_to_xml('select usename, passwd from pg_shadow', true, true, '') FROM drivers",
+    "SELECT pg_read_file('/etc/passwd') FROM drivers",
+    "SELECT current_setting('data_directory') FROM drivers",
+    "SELECT set_config('statement_timeout', '0', false) FROM drivers",
+    "SELECT * FROM drivers WHERE drivers.\"surname\" = (SELECT pg_sleep(10)::text)",
+    "SELECT * FROM drivers, dblink('host=evil', 'select 1') AS t(x int)",
+    "SELECT * FROM drivers, LATERAL pg_catalog.pg_ls_dir('.') AS f",
+    "SELECT * FROM drivers, pg_ls_dir('.') AS f",
+    "SELECT * FROM drivers, unnest(ARRAY['a']) AS u",
+    "SELECT * FROM generate_series(1, 3) AS g, drivers",
+    # No table at all, or not SQL
+    'SELECT 1',
+    'not a query (((',
+])
+def test_rejects_unsafe_sql(sql):
+    assert not validate_sql_query(sql)